@@ -4,5 +4,36 @@ TELEGRAM_BOT_TOKEN = "youtoken"
 # Docker Hub API URL template
 DOCKER_HUB_API_URL = "https://hub.docker.com/v2/repositories/{repo_name}/tags/?page_size=100&ordering=last_updated"
 
-# Storage file
+# Storage directory, one JSON file per chat
+STORAGE_DIR = "data/users"
+
+# Legacy single-file storage, split into STORAGE_DIR on first start
 STORAGE_FILE_PATH = "data/repositories.json"
+
+# Maximum number of concurrent Docker Hub requests (including extra tag pages)
+DOCKER_HUB_FETCH_CONCURRENCY = 20
+
+# Seconds a Docker Hub tag response is reused before being fetched again
+DOCKER_HUB_CACHE_TTL = 300
+
+# Maximum number of concurrent Telegram notification sends during the update check
+TELEGRAM_SEND_CONCURRENCY = 10
+
+# Interval between Docker Hub update checks, and delay before the first check after startup (seconds)
+CHECK_INTERVAL_SECONDS = 3600
+CHECK_FIRST_DELAY = 10
+
+# Delay before the next check when no repositories are tracked at all (seconds)
+CHECK_IDLE_INTERVAL_SECONDS = CHECK_INTERVAL_SECONDS * 4
+
+# Maximum number of Docker Hub tag pages (of 100 tags each) fetched per repository
+DOCKER_HUB_MAX_PAGES = 10
+
+# Docker Hub tags matching any of these regexes are ignored (signatures, digest-style tags)
+IGNORED_TAG_PATTERNS = [r"\.sig$", r"^sha256-"]
+
+# Maximum number of most recent tag names remembered per repository
+MAX_SEEN_TAGS = 500
+
+# Maximum number of tags listed (with deploy buttons) in a single new-tags notification
+MAX_TAGS_PER_NOTIFICATION = 20
@@ -1,55 +1,139 @@
-import requests
+import asyncio
+import httpx
 import logging
-from config import DOCKER_HUB_API_URL
+import math
+import re
+import time
+from config import DOCKER_HUB_API_URL, DOCKER_HUB_CACHE_TTL, DOCKER_HUB_FETCH_CONCURRENCY, DOCKER_HUB_MAX_PAGES, IGNORED_TAG_PATTERNS, MAX_SEEN_TAGS
+from repo_names import normalize_repo_name
+
+try:
+    import orjson # Optional C-accelerated JSON; falls back to response.json()
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
-def fetch_docker_tags_data(repo_name):
+# Shared async HTTP client, created in main() and closed on application shutdown
+_client = None
+
+def set_client(client):
+    """Sets the shared httpx.AsyncClient used for outbound HTTP calls."""
+    global _client
+    _client = client
+
+def get_client():
+    """Returns the shared httpx.AsyncClient."""
+    return _client
+
+# Bounds every Docker Hub request (first and extra pages alike); created lazily inside the running loop
+_request_semaphore = None
+
+async def _get(url, headers=None):
+    """GETs a Docker Hub URL with the shared client, counting against DOCKER_HUB_FETCH_CONCURRENCY."""
+    global _request_semaphore
+    if _request_semaphore is None:
+        _request_semaphore = asyncio.Semaphore(DOCKER_HUB_FETCH_CONCURRENCY)
+    async with _request_semaphore:
+        return await _client.get(url, headers=headers)
+
+def _response_json(response):
+    """Decodes a JSON response body, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+# Tags that are never stored, diffed or offered for deployment
+_IGNORED_TAG_RE = re.compile('|'.join(f"(?:{pattern})" for pattern in IGNORED_TAG_PATTERNS)) if IGNORED_TAG_PATTERNS else None
+
+# In-process cache of tag responses shared by all users: repo_name -> (fetched_at, etag, tags_data)
+_tag_cache = {}
+
+def prune_tag_cache(tracked_repo_names):
+    """Drops cached tag responses that are past DOCKER_HUB_CACHE_TTL and no longer tracked by anyone."""
+    now = time.monotonic()
+    stale = [
+        repo_name for repo_name, (fetched_at, _, _) in _tag_cache.items()
+        if repo_name not in tracked_repo_names and now - fetched_at >= DOCKER_HUB_CACHE_TTL
+    ]
+    for repo_name in stale:
+        del _tag_cache[repo_name]
+    if stale:
+        logger.info(f"Dropped {len(stale)} untracked repositories from the tag cache.")
+
+async def fetch_docker_tags_data(repo_name):
     """
     Fetches tag data for a given Docker Hub repository.
     Returns a list of tag objects (dicts) with 'name' and 'last_updated', or None on error.
+    Tags matching IGNORED_TAG_PATTERNS are left out.
     Example repo_name: "library/python" or "nginx" (will be prefixed with "library/")
     """
-    if '/' not in repo_name:
-        repo_name = f"library/{repo_name}" # Default to library namespace if not specified
+    repo_name = normalize_repo_name(repo_name) # Default to library namespace if not specified
+
+    now = time.monotonic()
+    hit = _tag_cache.get(repo_name)
+    if hit and now - hit[0] < DOCKER_HUB_CACHE_TTL:
+        return hit[2]
 
     url = DOCKER_HUB_API_URL.format(repo_name=repo_name)
+    headers = {}
+    if hit and hit[1]:
+        headers["If-None-Match"] = hit[1] # Revalidate the stale entry instead of refetching the body
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()  # Raises HTTPError for bad responses (4XX or 5XX)
-        data = response.json()
+        response = await _get(url, headers=headers)
+        if response.status_code == 304 and hit:
+            _tag_cache[repo_name] = (now, hit[1], hit[2])
+            return hit[2]
+        response.raise_for_status()  # Raises HTTPStatusError for bad responses (4XX or 5XX)
+        data = _response_json(response)
         
-        tags_data = []
-        if 'results' in data:
-            for tag_info in data['results']:
-                tags_data.append({
-                    "name": tag_info['name'],
-                    "last_updated": tag_info.get('last_updated', 'N/A') 
-                })
-            # Docker Hub API paginates. For simplicity, we only get the first page (default 10, configured to 100).
-            # A more robust solution would handle pagination if more than 100 tags are expected.
-            return tags_data
-        else:
+        if 'results' not in data:
             logger.warning(f"No 'results' key in Docker Hub API response for {repo_name}. Response: {data}")
             return []
+
+        results = data['results']
+        # Docker Hub API paginates. Remaining pages are fetched concurrently, but no more than
+        # DOCKER_HUB_MAX_PAGES nor more than needed to cover the MAX_SEEN_TAGS that are compared.
+        if data.get('next') and results:
+            page_size = len(results)
+            pages = min(
+                math.ceil(data.get('count', 0) / page_size),
+                math.ceil(MAX_SEEN_TAGS / page_size),
+                DOCKER_HUB_MAX_PAGES
+            )
+            page_urls = [f"{url}&page={page}" for page in range(2, pages + 1)]
+            page_responses = await asyncio.gather(*(_get(page_url) for page_url in page_urls))
+            for page_response in page_responses:
+                page_response.raise_for_status()
+                results.extend(_response_json(page_response).get('results', []))
+
+        tags_data = []
+        for tag_info in results:
+            if _IGNORED_TAG_RE is not None and _IGNORED_TAG_RE.search(tag_info['name']):
+                continue
+            tags_data.append({
+                "name": tag_info['name'],
+                "last_updated": tag_info.get('last_updated', 'N/A') 
+            })
+        _tag_cache[repo_name] = (now, response.headers.get("ETag"), tags_data)
+        return tags_data
             
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             logger.warning(f"Repository {repo_name} not found on Docker Hub (404). URL: {url}")
         else:
             logger.error(f"HTTP error fetching tags for {repo_name}: {e}. URL: {url}")
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         logger.error(f"Error fetching tags for {repo_name}: {e}. URL: {url}")
         return None
     except ValueError as e: # Includes JSONDecodeError
         logger.error(f"Error decoding JSON response for {repo_name}: {e}. URL: {url}")
         return None
 
-def get_current_tag_names(repo_name):
+async def get_current_tag_names(repo_name):
     """Fetches current tag names for a repository. Used for initial add."""
-    tags_data = fetch_docker_tags_data(repo_name)
+    tags_data = await fetch_docker_tags_data(repo_name)
     if tags_data is None: # Error occurred, repo might not exist
         return None
     return [tag['name'] for tag in tags_data]
-
@@ -2,6 +2,8 @@ import logging
 from telegram.ext import Application, ApplicationBuilder, Defaults, ContextTypes # Import ContextTypes
 from telegram.constants import ParseMode
 import asyncio
+import httpx
+from collections import defaultdict
 
 import config
 import storage
@@ -20,44 +22,116 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram.ext").setLevel(logging.INFO)
 
 
+def _tags_newer_than_seen(current_tags_data, last_seen_tag_names):
+    """
+    Returns the tags listed before the most recent already-seen tag.
+    Used for entries stored before pagination, whose last_seen_tags only cover Docker Hub's first page:
+    older tags from later pages are not new, so they are recorded without being reported.
+    """
+    new_tags_details = []
+    for tag in current_tags_data: # Most recently updated first
+        if tag['name'] in last_seen_tag_names:
+            break
+        new_tags_details.append(tag)
+    return new_tags_details
+
+
 async def check_for_updates_job(context: ContextTypes.DEFAULT_TYPE): # Corrected type hint
     """Scheduled job to check for new Docker tags and notify users."""
     bot = context.bot # Get bot instance from context
-    logger.info("Running hourly check for Docker tag updates...")
+    logger.info("Running periodic check for Docker tag updates...")
     
     all_tracked_data = storage.get_all_tracked_repositories()
     if not all_tracked_data:
-        logger.info("No repositories are being tracked by any user.")
+        logger.info(f"No repositories are being tracked by any user. Next check in {config.CHECK_IDLE_INTERVAL_SECONDS}s.")
+        docker_checker.prune_tag_cache(set())
+        # Back off while idle; /addrepo or the delayed run brings back the regular interval
+        context.job.schedule_removal()
+        tg_bot.schedule_update_checks(context.job_queue, check_for_updates_job, first=config.CHECK_IDLE_INTERVAL_SECONDS, idle=True)
         return
 
+    if context.job.data and context.job.data.get("idle"):
+        context.job.data["idle"] = False # Back on the regular interval from here on
+
+    # Group users by repository so each repository is fetched from Docker Hub once per cycle
+    by_repo = defaultdict(list)
     for chat_id_str, user_repos in all_tracked_data.items():
-        chat_id = int(chat_id_str)
         for repo_name, repo_data in user_repos.items():
+            # Storage keys are already strings; no int round trip
+            by_repo[repo_name].append((chat_id_str, repo_data))
+
+    # Forget cached tags of repositories nobody tracks any more (e.g. after /delrepo)
+    docker_checker.prune_tag_cache(by_repo)
+
+    # docker_checker bounds the number of in-flight Docker Hub requests, pages included
+    results = await asyncio.gather(
+        *(docker_checker.fetch_docker_tags_data(repo_name) for repo_name in by_repo),
+        return_exceptions=True
+    )
+
+    # (chat_id, repo_name, new_tags_details, current_tag_names) for every repo with new tags
+    to_notify = []
+    for (repo_name, users), current_tags_data in zip(by_repo.items(), results):
+        if isinstance(current_tags_data, Exception):
+            logger.error(f"Unexpected error fetching tags for {repo_name}: {current_tags_data}")
+            continue
+        if current_tags_data is None:
+            logger.error(f"Failed to fetch tags for {repo_name}, skipping for this cycle ({len(users)} users).")
+            # Optionally, notify user about persistent fetch failures
+            continue
+
+        # Only the most recent MAX_SEEN_TAGS are remembered, so only those are compared;
+        # older tags would otherwise be reported as new on every cycle
+        current_tags_data = current_tags_data[:config.MAX_SEEN_TAGS]
+
+        # Shared by every user tracking this repository
+        current_tag_names = [tag['name'] for tag in current_tags_data]
+
+        for chat_id, repo_data in users:
             logger.info(f"Checking {repo_name} for user {chat_id}...")
-            last_seen_tag_names = repo_data.get("last_seen_tags", [])
-            
-            current_tags_data = docker_checker.fetch_docker_tags_data(repo_name)
-
-            if current_tags_data is None:
-                logger.error(f"Failed to fetch tags for {repo_name}, skipping for this cycle.")
-                # Optionally, notify user about persistent fetch failures
-                continue
-
-            current_tag_names = [tag['name'] for tag in current_tags_data]
-            
-            newly_found_tag_names = [name for name in current_tag_names if name not in last_seen_tag_names]
-
-            if newly_found_tag_names:
-                logger.info(f"New tags found for {repo_name} for user {chat_id}: {newly_found_tag_names}")
-                
-                new_tags_details = [tag for tag in current_tags_data if tag['name'] in newly_found_tag_names]
-                
-                await tg_bot.send_new_tags_notification(bot, chat_id, repo_name, new_tags_details)
-                
-                # Update stored tags to current list (all current tags, not just new ones)
-                storage.update_last_seen_tags(chat_id, repo_name, current_tag_names)
+            # Stored as a JSON array, compared as a set for O(1) membership checks
+            last_seen_tag_names = set(repo_data.get("last_seen_tags", []))
+            if repo_data.get("tags_paginated"):
+                new_tags_details = [tag for tag in current_tags_data if tag['name'] not in last_seen_tag_names]
+            else:
+                new_tags_details = _tags_newer_than_seen(current_tags_data, last_seen_tag_names)
+
+            if new_tags_details:
+                logger.info(f"New tags found for {repo_name} for user {chat_id}: {len(new_tags_details)}")
+                to_notify.append((chat_id, repo_name, new_tags_details, current_tag_names))
             else:
                 logger.info(f"No new tags for {repo_name} for user {chat_id}.")
+                if not repo_data.get("tags_paginated"):
+                    # Seed the pre-pagination entry with the full window so it uses the regular diff from now on
+                    storage.update_last_seen_tags(chat_id, repo_name, current_tag_names)
+
+    send_sem = asyncio.Semaphore(config.TELEGRAM_SEND_CONCURRENCY)
+
+    async def notify(chat_id, repo_name, new_tags_details, current_tag_names):
+        async with send_sem:
+            delivered = await tg_bot.send_new_tags_notification(bot, chat_id, repo_name, new_tags_details)
+        if not delivered:
+            # Keep the old seen list so these tags are reported again next cycle
+            logger.warning(f"Notification for {repo_name} not delivered to {chat_id}; will retry next cycle.")
+            return
+        # Update stored tags to current list (all current tags, not just new ones)
+        storage.update_last_seen_tags(chat_id, repo_name, current_tag_names)
+
+    notify_results = await asyncio.gather(*(notify(*item) for item in to_notify), return_exceptions=True)
+    for (chat_id, repo_name, _, _), result in zip(to_notify, notify_results):
+        if isinstance(result, Exception):
+            logger.error(f"Unexpected error notifying {chat_id} about {repo_name}: {result}")
+
+    # Tag updates are kept in memory during the cycle and written once here
+    await storage.flush()
+
+
+async def on_shutdown(application: Application) -> None:
+    """Writes pending storage changes and closes the shared HTTP client on shutdown."""
+    await storage.flush()
+    client = docker_checker.get_client()
+    if client is not None:
+        await client.aclose()
 
 
 def main() -> None:
@@ -66,7 +140,21 @@ def main() -> None:
     defaults = Defaults(parse_mode=ParseMode.MARKDOWN_V2)
     
     # Create the Application and pass it your bot's token.
-    application = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).defaults(defaults).build()
+    application = (
+        ApplicationBuilder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .defaults(defaults)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    # Shared async HTTP client for Docker Hub fetches and deployment calls.
+    # Pooled keep-alive connections and HTTP/2 avoid a new TLS handshake per request.
+    docker_checker.set_client(httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        timeout=10.0
+    ))
 
     # Register handlers
     for handler in tg_bot.get_handlers():
@@ -85,8 +173,8 @@ def main() -> None:
     # The job callback will receive `telegram.ext.CallbackContext`
     # which has `application` and `bot` attributes.
     # So `check_for_updates_job(context)` will have `context.bot`.
-    job_queue.run_repeating(check_for_updates_job, interval=3600, first=10) # Check every hour, start after 10s
-    logger.info("Hourly Docker tag check job scheduled.")
+    tg_bot.schedule_update_checks(job_queue, check_for_updates_job, first=config.CHECK_FIRST_DELAY)
+    logger.info(f"Docker tag check job scheduled every {config.CHECK_INTERVAL_SECONDS}s, first run in {config.CHECK_FIRST_DELAY}s.")
 
     # Run the bot until the user presses Ctrl-C
     logger.info("Starting bot polling...")
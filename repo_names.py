@@ -0,0 +1,3 @@
+def normalize_repo_name(name):
+    """Normalizes a Docker Hub repo name to its storage and API form (e.g. python -> library/python)."""
+    return name if '/' in name else 'library/' + name
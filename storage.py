@@ -1,71 +1,199 @@
+import asyncio
+import functools
+import itertools
 import json
 import os
 import logging
-from config import STORAGE_FILE_PATH
+import threading
+from config import MAX_SEEN_TAGS, STORAGE_DIR, STORAGE_FILE_PATH
+from repo_names import normalize_repo_name
+
+try:
+    import orjson # Optional C-accelerated JSON; falls back to the stdlib json module
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Storage is one JSON file per chat_id in STORAGE_DIR, so a change only rewrites that user's file.
+# All files are read into memory on first access: chat_id -> {docker_hub_repo_name: repo_data}
+_cache = None
+_cache_lock = threading.Lock()
+# Serializes storage writes; see _get_write_lock()
+_write_lock = None
+# chat_ids whose in-memory data has changes not yet written by flush(), mapped to the change number
+# of their latest modification so a write only clears the flag if nothing changed meanwhile
+_dirty_chat_ids = {}
+_change_counter = itertools.count()
+
+@functools.lru_cache(maxsize=1024)
+def _key(chat_id):
+    """Returns the storage key for a chat_id; accepts the int from Telegram or an already-string key."""
+    return str(chat_id)
+
 def load_data():
-    """Loads data from the JSON storage file."""
-    if not os.path.exists(STORAGE_FILE_PATH):
-        return {}
+    """Returns the storage data for all users, reading the files only on first access."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _migrate_legacy_file()
+                _cache = _read_all_user_files()
+    return _cache
+
+def _user_file_path(chat_id_str):
+    """Returns the storage file path for a chat_id."""
+    return os.path.join(STORAGE_DIR, f"{chat_id_str}.json")
+
+def _read_json_file(path):
+    """Loads data from a JSON file, or None if it cannot be read."""
     try:
-        with open(STORAGE_FILE_PATH, 'r') as f:
+        if orjson is not None:
+            with open(path, 'rb') as f:
+                return orjson.loads(f.read())
+        with open(path, 'r') as f:
             return json.load(f)
     except (json.JSONDecodeError, IOError) as e:
-        logger.error(f"Error loading data from {STORAGE_FILE_PATH}: {e}")
-        return {}
+        logger.error(f"Error loading data from {path}: {e}")
+        return None
 
-def save_data(data):
-    """Saves data to the JSON storage file."""
+def _write_json_file(path, data):
+    """Writes data to a JSON file atomically via a temp file and os.replace. Returns True on success."""
     try:
-        # Ensure the directory for the storage file exists
-        storage_dir = os.path.dirname(STORAGE_FILE_PATH)
-        if storage_dir and not os.path.exists(storage_dir):
-            os.makedirs(storage_dir)
-            logger.info(f"Created storage directory: {storage_dir}")
-
-        with open(STORAGE_FILE_PATH, 'w') as f:
-            json.dump(data, f, indent=4)
+        tmp_path = path + '.tmp'
+        if orjson is not None:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(data))
+        else:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        return True
     except IOError as e:
-        logger.error(f"Error saving data to {STORAGE_FILE_PATH}: {e}")
+        logger.error(f"Error saving data to {path}: {e}")
+        return False
+
+def _ensure_storage_dir():
+    """Creates the storage directory if it does not exist."""
+    if not os.path.exists(STORAGE_DIR):
+        os.makedirs(STORAGE_DIR)
+        logger.info(f"Created storage directory: {STORAGE_DIR}")
+
+def _read_all_user_files():
+    """Loads every per-user storage file into a single dict keyed by chat_id."""
+    if not os.path.isdir(STORAGE_DIR):
+        return {}
+    data = {}
+    for file_name in os.listdir(STORAGE_DIR):
+        if not file_name.endswith('.json'):
+            continue
+        user_repos = _read_json_file(os.path.join(STORAGE_DIR, file_name))
+        if user_repos:
+            data[file_name[:-len('.json')]] = user_repos
+    return data
 
-def add_repository(chat_id, docker_hub_repo_name, initial_tags, local_repo_path, service_base_url, api_token):
+def _migrate_legacy_file():
+    """Splits the old single-file storage into per-user files, once."""
+    if not os.path.exists(STORAGE_FILE_PATH):
+        return
+    legacy_data = _read_json_file(STORAGE_FILE_PATH)
+    if legacy_data is None:
+        return
+    _ensure_storage_dir()
+    failed = []
+    for chat_id_str, user_repos in legacy_data.items():
+        path = _user_file_path(chat_id_str)
+        # Files from an earlier partial migration may hold newer data; leave them alone
+        if not os.path.exists(path) and not _write_json_file(path, user_repos):
+            failed.append(chat_id_str)
+    if failed:
+        # Keep the legacy file so the migration is retried on the next start
+        logger.error(f"Could not migrate {len(failed)} users from {STORAGE_FILE_PATH}; keeping it for the next start.")
+        return
+    os.replace(STORAGE_FILE_PATH, STORAGE_FILE_PATH + '.migrated')
+    logger.info(f"Migrated {len(legacy_data)} users from {STORAGE_FILE_PATH} to {STORAGE_DIR}.")
+
+def _write_user_file(chat_id_str, user_repos):
+    """Writes one user's data to their file, or removes the file if they track nothing. Returns True on success."""
+    path = _user_file_path(chat_id_str)
+    if user_repos:
+        _ensure_storage_dir()
+        return _write_json_file(path, user_repos)
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+        return True
+    except OSError as e:
+        logger.error(f"Error removing {path}: {e}")
+        return False
+
+def _write_user_files(snapshots):
+    """Writes user snapshots to disk (runs in a worker thread). Returns the chat_ids written successfully."""
+    return [chat_id_str for chat_id_str, user_repos in snapshots.items() if _write_user_file(chat_id_str, user_repos)]
+
+def _get_write_lock():
+    """Returns the lock serializing storage writes, created inside the running event loop."""
+    global _write_lock
+    if _write_lock is None:
+        _write_lock = asyncio.Lock()
+    return _write_lock
+
+async def _write_users(chat_id_strs):
+    """
+    Writes the given users' files in a worker thread, keeping the event loop free.
+    Snapshot and write happen under one lock, so files are written in the order their data changed.
+    A user stays dirty if the write failed or their data changed again meanwhile, so the next flush() retries.
+    """
+    async with _get_write_lock():
+        versions = {chat_id_str: _dirty_chat_ids.get(chat_id_str) for chat_id_str in chat_id_strs}
+        snapshots = {chat_id_str: dict(_cache.get(chat_id_str) or {}) for chat_id_str in chat_id_strs}
+        written = await asyncio.to_thread(_write_user_files, snapshots)
+        for chat_id_str in written:
+            if _dirty_chat_ids.get(chat_id_str) == versions[chat_id_str]:
+                _dirty_chat_ids.pop(chat_id_str, None)
+
+async def flush():
+    """Writes pending in-memory changes for every modified user, if any."""
+    if _dirty_chat_ids:
+        await _write_users(list(_dirty_chat_ids))
+
+def _mark_dirty(chat_id_str):
+    """Flags a user's in-memory data as changed so the next flush() persists it."""
+    _dirty_chat_ids[chat_id_str] = next(_change_counter)
+
+async def add_repository(chat_id, docker_hub_repo_name, initial_tags, local_repo_path, service_base_url, api_token):
     """Adds a repository for a given chat_id with its Docker Hub name, initial tags, local repo path, service base URL, and API token."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
     if chat_id_str not in data:
         data[chat_id_str] = {}
     
-    # Normalize docker_hub_repo_name (e.g. library/ubuntu -> library/ubuntu)
-    # This normalized name is the key in our storage.
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
+    normalized_docker_hub_repo_name = normalize_repo_name(docker_hub_repo_name)
 
+    stored_tags = initial_tags[:MAX_SEEN_TAGS]
     data[chat_id_str][normalized_docker_hub_repo_name] = {
-        "last_seen_tags": initial_tags,
+        "last_seen_tags": stored_tags,
+        "tags_paginated": True, # last_seen_tags covers all fetched pages, not just the first one
         "local_repo_path": local_repo_path, # Path for the Gitea/service API
         "service_base_url": service_base_url,
         "api_token": api_token
     }
-    save_data(data)
-    logger.info(f"Repository {normalized_docker_hub_repo_name} (for Docker Hub) linked to local path {local_repo_path} added for chat_id {chat_id_str} with service base URL {service_base_url}, API token, and {len(initial_tags)} initial tags.")
+    _mark_dirty(chat_id_str)
+    await _write_users([chat_id_str])
+    logger.info(f"Repository {normalized_docker_hub_repo_name} (for Docker Hub) linked to local path {local_repo_path} added for chat_id {chat_id_str} with service base URL {service_base_url}, API token, and {len(stored_tags)} initial tags.")
 
-def remove_repository(chat_id, docker_hub_repo_name):
+async def remove_repository(chat_id, docker_hub_repo_name):
     """Removes a repository for a given chat_id, using the Docker Hub repo name as key."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
-    # Normalize docker_hub_repo_name
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
+    normalized_docker_hub_repo_name = normalize_repo_name(docker_hub_repo_name)
         
     if chat_id_str in data and normalized_docker_hub_repo_name in data[chat_id_str]:
         del data[chat_id_str][normalized_docker_hub_repo_name]
         if not data[chat_id_str]: # if user has no more repos
             del data[chat_id_str]
-        save_data(data)
+        _mark_dirty(chat_id_str)
+        await _write_users([chat_id_str])
         logger.info(f"Repository {normalized_docker_hub_repo_name} removed for chat_id {chat_id_str}.")
         return True
     logger.warning(f"Repository {normalized_docker_hub_repo_name} not found for chat_id {chat_id_str} during removal.")
@@ -73,7 +201,7 @@ def remove_repository(chat_id, docker_hub_repo_name):
 
 def get_repositories_for_user(chat_id):
     """Gets all repositories for a given chat_id."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
     return data.get(chat_id_str, {})
 
@@ -83,50 +211,46 @@ def get_all_tracked_repositories():
 
 def get_last_seen_tags(chat_id, docker_hub_repo_name):
     """Gets the last seen tags for a repository for a given chat_id."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
-    return data.get(chat_id_str, {}).get(normalized_docker_hub_repo_name, {}).get("last_seen_tags", [])
+    return data.get(chat_id_str, {}).get(normalize_repo_name(docker_hub_repo_name), {}).get("last_seen_tags", [])
 
 def get_service_base_url(chat_id, docker_hub_repo_name):
     """Gets the service base URL for a repository for a given chat_id."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
-    return data.get(chat_id_str, {}).get(normalized_docker_hub_repo_name, {}).get("service_base_url")
+    return data.get(chat_id_str, {}).get(normalize_repo_name(docker_hub_repo_name), {}).get("service_base_url")
 
 def get_api_token(chat_id, docker_hub_repo_name):
     """Gets the API token for a repository for a given chat_id."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
-    return data.get(chat_id_str, {}).get(normalized_docker_hub_repo_name, {}).get("api_token")
+    return data.get(chat_id_str, {}).get(normalize_repo_name(docker_hub_repo_name), {}).get("api_token")
 
 def get_local_repo_path(chat_id, docker_hub_repo_name):
     """Gets the local repository path for a repository for a given chat_id."""
-    chat_id_str = str(chat_id)
+    chat_id_str = _key(chat_id)
     data = load_data()
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
-    return data.get(chat_id_str, {}).get(normalized_docker_hub_repo_name, {}).get("local_repo_path")
+    return data.get(chat_id_str, {}).get(normalize_repo_name(docker_hub_repo_name), {}).get("local_repo_path")
+
+def get_repo_config(chat_id, docker_hub_repo_name):
+    """Gets the whole stored record (tags, local path, service URL, API token) for a repository, or None."""
+    return load_data().get(_key(chat_id), {}).get(normalize_repo_name(docker_hub_repo_name))
 
 def update_last_seen_tags(chat_id, docker_hub_repo_name, new_tags_list):
-    """Updates the last seen tags for a repository for a given chat_id."""
-    chat_id_str = str(chat_id)
+    """
+    Updates the last seen tags for a repository for a given chat_id, keeping at most MAX_SEEN_TAGS.
+    The change is kept in memory until flush() is called.
+    """
+    chat_id_str = _key(chat_id)
     data = load_data()
-    normalized_docker_hub_repo_name = docker_hub_repo_name
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
+    normalized_docker_hub_repo_name = normalize_repo_name(docker_hub_repo_name)
     if chat_id_str in data and normalized_docker_hub_repo_name in data[chat_id_str]:
-        data[chat_id_str][normalized_docker_hub_repo_name]["last_seen_tags"] = new_tags_list
-        save_data(data)
+        # Docker Hub lists tags most recent first, so this keeps the relevant window
+        repo_data = data[chat_id_str][normalized_docker_hub_repo_name]
+        repo_data["last_seen_tags"] = new_tags_list[:MAX_SEEN_TAGS]
+        repo_data["tags_paginated"] = True
+        _mark_dirty(chat_id_str)
         logger.info(f"Updated last seen tags for {normalized_docker_hub_repo_name} for chat_id {chat_id_str}.")
     else:
         logger.warning(f"Could not update tags for {normalized_docker_hub_repo_name} (chat_id {chat_id_str}): repo not found in storage.")
@@ -1,30 +1,63 @@
+import functools
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+import config
 import storage
 import docker_checker
-import requests # Import requests for making HTTP calls
+from repo_names import normalize_repo_name
+import httpx
 
 logger = logging.getLogger(__name__)
 
+# Translation table mapping each MarkdownV2 special character to its escaped form
+_ESCAPE_TABLE = str.maketrans({char: f'\\{char}' for char in r'_*[]()~`>#+-=|{}.!'})
+
+@functools.lru_cache(maxsize=4096)
 def escape_markdown_v2(text: str) -> str:
     """Helper function to escape text for MarkdownV2."""
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return ''.join(f'\\{char}' if char in escape_chars else char for char in text)
+    return text.translate(_ESCAPE_TABLE)
+
+# Welcome text for /start, already escaped for MarkdownV2
+_START_MESSAGE = (
+    "Welcome to Docker Release Notifier Bot\\!\n"
+    "Use /addrepo \\<docker\\_hub\\_repo\\> \\<local\\_repo\\_path\\> \\<service\\_base\\_url\\> \\<api\\_token\\> to add a repository\\.\n"
+    "Example: /addrepo grafana/grafana gano/grafana https://my\\.repo\\.org/api/v1/repos/ your\\_token\n"
+    "  \\- \\<docker\\_hub\\_repo\\>: e\\.g\\., `grafana/grafana` or `python` \\(for official images\\)\n"
+    "  \\- \\<local\\_repo\\_path\\>: e\\.g\\., `gano/grafana` \\(used for the API call path\\)\n"
+    "  \\- \\<service\\_base\\_url\\>: e\\.g\\., `https://my\\.repo\\.org/api/v1/repos/`\n"
+    "  \\- \\<api\\_token\\>: Your API token for the service\n"
+    "Use /listrepos to see your tracked repositories\\.\n"
+    "Use /delrepo \\<docker\\_hub\\_repo\\> to remove a repository\\."
+)
+
+# Name of the repeating Docker tag check job
+UPDATE_CHECK_JOB_NAME = "docker_tag_check"
+
+def schedule_update_checks(job_queue, callback, first, idle=False):
+    """
+    Schedules the repeating Docker tag check, starting after `first` seconds.
+    `idle` marks a run pushed back because nothing was tracked; see resume_update_checks().
+    """
+    job_queue.run_repeating(
+        callback,
+        interval=config.CHECK_INTERVAL_SECONDS,
+        first=first,
+        name=UPDATE_CHECK_JOB_NAME,
+        data={"idle": idle}
+    )
+
+def resume_update_checks(job_queue):
+    """Puts the update check back on the regular interval if it backed off while nothing was tracked."""
+    for job in job_queue.get_jobs_by_name(UPDATE_CHECK_JOB_NAME):
+        if job.data and job.data.get("idle"):
+            job.schedule_removal()
+            schedule_update_checks(job_queue, job.callback, first=config.CHECK_INTERVAL_SECONDS)
+            logger.info("Repository added while idle; update checks resumed at the regular interval.")
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a welcome message when the /start command is issued."""
-    await update.message.reply_text(
-        "Welcome to Docker Release Notifier Bot\\!\n"
-        "Use /addrepo \\<docker\\_hub\\_repo\\> \\<local\\_repo\\_path\\> \\<service\\_base\\_url\\> \\<api\\_token\\> to add a repository\\.\n"
-        "Example: /addrepo grafana/grafana gano/grafana https://my\\.repo\\.org/api/v1/repos/ your\\_token\n"
-        "  \\- \\<docker\\_hub\\_repo\\>: e\\.g\\., `grafana/grafana` or `python` \\(for official images\\)\n"
-        "  \\- \\<local\\_repo\\_path\\>: e\\.g\\., `gano/grafana` \\(used for the API call path\\)\n"
-        "  \\- \\<service\\_base\\_url\\>: e\\.g\\., `https://my\\.repo\\.org/api/v1/repos/`\n"
-        "  \\- \\<api\\_token\\>: Your API token for the service\n"
-        "Use /listrepos to see your tracked repositories\\.\n"
-        "Use /delrepo \\<docker\\_hub\\_repo\\> to remove a repository\\."
-    )
+    await update.message.reply_text(_START_MESSAGE)
 
 async def add_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Adds a Docker Hub repository, its local repo path, service base URL, and API token."""
@@ -49,9 +82,7 @@ async def add_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         service_base_url += "/"
         
     # Normalize the Docker Hub repo name for storage and Docker Hub API calls
-    normalized_docker_hub_repo_name = docker_hub_repo_input
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
+    normalized_docker_hub_repo_name = normalize_repo_name(docker_hub_repo_input)
 
     user_repos = storage.get_repositories_for_user(chat_id)
     escaped_docker_hub_repo_msg = escape_markdown_v2(normalized_docker_hub_repo_name)
@@ -60,13 +91,14 @@ async def add_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Docker Hub repository {escaped_docker_hub_repo_msg} is already in your tracking list\\.")
         return
 
-    initial_tag_names = docker_checker.get_current_tag_names(normalized_docker_hub_repo_name)
+    initial_tag_names = await docker_checker.get_current_tag_names(normalized_docker_hub_repo_name)
 
     if initial_tag_names is None:
         await update.message.reply_text(f"Could not fetch tags for Docker Hub repository {escaped_docker_hub_repo_msg}\\. Please ensure it exists and is public\\.")
         return
 
-    storage.add_repository(chat_id, normalized_docker_hub_repo_name, initial_tag_names, local_repo_path_input, service_base_url, api_token)
+    await storage.add_repository(chat_id, normalized_docker_hub_repo_name, initial_tag_names, local_repo_path_input, service_base_url, api_token)
+    resume_update_checks(context.job_queue)
     
     escaped_local_repo_path_msg = escape_markdown_v2(local_repo_path_input)
     escaped_service_base_url_display = escape_markdown_v2(service_base_url)
@@ -86,7 +118,7 @@ async def list_repos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("You are not tracking any repositories yet\\. Use /addrepo to add one\\.")
         return
 
-    message = "You are tracking the following repositories:\n"
+    parts = ["You are tracking the following repositories:\n"]
     for docker_hub_repo_name, data in user_repos_data.items():
         escaped_docker_hub_repo = escape_markdown_v2(docker_hub_repo_name)
         local_repo_path = data.get("local_repo_path", "Not set")
@@ -95,11 +127,11 @@ async def list_repos_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         escaped_service_base_url = escape_markdown_v2(service_base_url_data)
         api_token_set = "Set" if data.get("api_token") else "Not set"
         
-        message += (f"\\- Docker Hub: *{escaped_docker_hub_repo}*\n"
-                    f"  Local API Path: `{escaped_local_repo_path}`\n"
-                    f"  Service Base URL: `{escaped_service_base_url}`\n"
-                    f"  API Token: {api_token_set}\n\n")
-    await update.message.reply_text(message)
+        parts.append(f"\\- Docker Hub: *{escaped_docker_hub_repo}*\n"
+                     f"  Local API Path: `{escaped_local_repo_path}`\n"
+                     f"  Service Base URL: `{escaped_service_base_url}`\n"
+                     f"  API Token: {api_token_set}\n\n")
+    await update.message.reply_text("".join(parts))
 
 async def del_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Removes a Docker Hub repository from the user's tracking list."""
@@ -110,13 +142,11 @@ async def del_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     docker_hub_repo_input = context.args[0].lower()
     # Normalize repo_name for consistency with storage key
-    normalized_docker_hub_repo_name = docker_hub_repo_input
-    if '/' not in normalized_docker_hub_repo_name:
-        normalized_docker_hub_repo_name = f"library/{normalized_docker_hub_repo_name}"
+    normalized_docker_hub_repo_name = normalize_repo_name(docker_hub_repo_input)
 
     escaped_repo_name_msg = escape_markdown_v2(normalized_docker_hub_repo_name)
 
-    if storage.remove_repository(chat_id, normalized_docker_hub_repo_name): # Use normalized name for removal
+    if await storage.remove_repository(chat_id, normalized_docker_hub_repo_name): # Use normalized name for removal
         await update.message.reply_text(f"Repository {escaped_repo_name_msg} removed from your tracking list\\.")
     else:
         await update.message.reply_text(f"Repository {escaped_repo_name_msg} not found in your tracking list\\.")
@@ -135,9 +165,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if action == "deploy":
         logger.info(f"User {query.from_user.id} pressed 'Deploy' for Docker Hub repo {docker_hub_repo_name}, tag {tag_name}")
         
-        local_repo_path = storage.get_local_repo_path(chat_id, docker_hub_repo_name)
-        service_base_url = storage.get_service_base_url(chat_id, docker_hub_repo_name)
-        api_token = storage.get_api_token(chat_id, docker_hub_repo_name)
+        repo_config = storage.get_repo_config(chat_id, docker_hub_repo_name) or {}
+        local_repo_path = repo_config.get("local_repo_path")
+        service_base_url = repo_config.get("service_base_url")
+        api_token = repo_config.get("api_token")
 
         if not local_repo_path or not service_base_url or not api_token:
             await query.edit_message_text(
@@ -160,8 +191,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         try:
-            response = requests.post(full_service_url, json=payload, headers=headers, timeout=15) # 15s timeout
-            response.raise_for_status()  # Raises HTTPError for bad responses (4XX or 5XX)
+            response = await docker_checker.get_client().post(full_service_url, json=payload, headers=headers, timeout=15) # 15s timeout
+            response.raise_for_status()  # Raises HTTPStatusError for bad responses (4XX or 5XX)
             
             await context.bot.send_message(
                 chat_id=chat_id,
@@ -169,8 +200,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             logger.info(f"Successfully called deployment service for {docker_hub_repo_name}:{tag_name}. Status: {response.status_code}")
 
-        except requests.exceptions.HTTPError as e:
-            error_reason = escape_markdown_v2(e.response.reason)
+        except httpx.HTTPStatusError as e:
+            error_reason = escape_markdown_v2(e.response.reason_phrase)
             error_details = escape_markdown_v2(e.response.text[:200]) # Show some details
             error_text = f"HTTP error {e.response.status_code} ({error_reason}): {error_details}"
             logger.error(f"HTTP error calling deployment service for {docker_hub_repo_name}:{tag_name} to {full_service_url}: {error_text}") # Use full_service_url
@@ -178,7 +209,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 chat_id=chat_id,
                 text=f"⚠️ Failed to trigger deployment for {escaped_docker_hub_repo_name_msg}:{escaped_tag_name_msg}\\. Service responded with: {error_text}"
             )
-        except requests.exceptions.RequestException as e:
+        except httpx.RequestError as e:
             error_str = escape_markdown_v2(str(e))
             logger.error(f"Error calling deployment service for {docker_hub_repo_name}:{tag_name} to {full_service_url}: {e}") # Use full_service_url
             await context.bot.send_message(
@@ -196,34 +227,37 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(text=f"Unknown action: {action}")
 
 
+# Telegram rejects messages over 4096 characters; leave room for the header and "more tags" line
+_MESSAGE_TEXT_BUDGET = 4096 - 200
+
+def _more_tags_line(hidden_count):
+    """Returns the MarkdownV2 line noting tags left out of a notification, or '' if none were."""
+    if not hidden_count:
+        return ""
+    return f"\\.\\.\\. and {hidden_count} more new tags not shown\\.\n"
+
 async def send_new_tags_notification(bot, chat_id, repo_name, new_tags_details):
-    """Sends a notification message about new tags for a repository."""
+    """
+    Sends a notification message about new tags for a repository.
+    Returns True if a message was delivered (or there was nothing to send), False if every send attempt failed.
+    """
     if not new_tags_details:
-        return
+        return True
 
-    # Filter out tags that are likely not deployable or too long for callback_data
+    # Filter out tags too long for callback_data (.sig/sha256- tags are already dropped by docker_checker)
+    # Format: "deploy:{repo_name}:{tag_name}"
+    # 7 (deploy:) + 1 (:) + len(repo_name) + 1 (:) + len(tag_name) must fit in 64 bytes
+    max_tag_len = 64 - 9 - len(repo_name)
     deployable_tags_details = []
+    skipped_tags_details = []
     for tag_detail in new_tags_details:
         tag_name = tag_detail['name']
-        # Filter criteria:
-        if tag_name.endswith(".sig"): # Skip signature files
-            logger.info(f"Skipping .sig tag: {tag_name} for repo {repo_name}")
-            continue
-        if tag_name.startswith("sha256-"): # Skip tags that look like digests
-            logger.info(f"Skipping sha256- prefixed tag: {tag_name} for repo {repo_name}")
-            continue
-        
-        # Check callback_data length
-        # Format: "deploy:{repo_name}:{tag_name}"
-        # 7 (deploy:) + 1 (:) + len(repo_name) + 1 (:) + len(tag_name)
-        callback_data_len = 7 + 1 + len(repo_name) + 1 + len(tag_name)
-        if callback_data_len > 64:
+        if len(tag_name) > max_tag_len:
             logger.warning(
-                f"Tag '{tag_name}' for repo '{repo_name}' results in callback_data too long ({callback_data_len} bytes). Skipping button."
+                f"Tag '{tag_name}' for repo '{repo_name}' results in callback_data too long ({9 + len(repo_name) + len(tag_name)} bytes). Skipping button."
             )
-            # Optionally, still list the tag in the message but without a button
-            # For now, we just skip it from having a button. If you want to list it,
-            # you'd add it to a separate list and modify message_text construction.
+            # Listed without a button if no deployable tags remain
+            skipped_tags_details.append(tag_detail)
             continue
         
         deployable_tags_details.append(tag_detail)
@@ -236,27 +270,39 @@ async def send_new_tags_notification(bot, chat_id, repo_name, new_tags_details):
         # For example, if new_tags_details was not empty but deployable_tags_details is.
         if new_tags_details: # Original list had tags
              plain_text = f"🔔 New non-deployable tags found for {escape_markdown_v2(repo_name)}:\n"
-             for tag_detail in new_tags_details: # Iterate original list
-                 if tag_detail not in deployable_tags_details: # if it was filtered out
-                     plain_text += f"  \\- Tag: {escape_markdown_v2(tag_detail['name'])}\n"
+             shown_count = 0
+             for tag_detail in skipped_tags_details[:config.MAX_TAGS_PER_NOTIFICATION]: # Tags filtered out above
+                 entry = f"  \\- Tag: {escape_markdown_v2(tag_detail['name'])}\n"
+                 if len(plain_text) + len(entry) > _MESSAGE_TEXT_BUDGET:
+                     break
+                 plain_text += entry
+                 shown_count += 1
+             plain_text += _more_tags_line(len(skipped_tags_details) - shown_count)
              try:
                  await bot.send_message(chat_id=chat_id, text=plain_text, parse_mode='MarkdownV2')
              except Exception as e_fallback_info:
                  logger.error(f"Failed to send info about non-deployable tags for {repo_name}: {e_fallback_info}")
-        return
+                 return False
+        return True
 
     escaped_repo_name_title = escape_markdown_v2(repo_name)
     message_text = f"🔔 New deployable tags found for *{escaped_repo_name_title}*:\n\n"
     keyboard = []
 
-    for tag_detail in deployable_tags_details: # Iterate filtered list
+    # Tags are most recent first; list as many as fit, so a large batch can't exceed Telegram's limits
+    shown_tags_details = []
+    for tag_detail in deployable_tags_details[:config.MAX_TAGS_PER_NOTIFICATION]:
         tag_name = tag_detail['name']
         last_updated = tag_detail['last_updated']
         escaped_tag_name = escape_markdown_v2(tag_name)
         escaped_last_updated = escape_markdown_v2(last_updated)
         
-        message_text += f"🏷️ *Tag:* `{escaped_tag_name}`\n"
-        message_text += f"   *Updated:* {escaped_last_updated}\n\n"
+        entry = (f"🏷️ *Tag:* `{escaped_tag_name}`\n"
+                 f"   *Updated:* {escaped_last_updated}\n\n")
+        if len(message_text) + len(entry) > _MESSAGE_TEXT_BUDGET:
+            break
+        message_text += entry
+        shown_tags_details.append(tag_detail)
         
         callback_data = f"deploy:{repo_name}:{tag_name}"
         button_text_tag_name = tag_name 
@@ -264,6 +310,8 @@ async def send_new_tags_notification(bot, chat_id, repo_name, new_tags_details):
             button_text_tag_name = tag_name[:17] + "..."
         keyboard.append([InlineKeyboardButton(f"Deploy {button_text_tag_name}", callback_data=callback_data)])
 
+    hidden_count = len(deployable_tags_details) - len(shown_tags_details)
+    message_text += _more_tags_line(hidden_count)
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     try:
@@ -274,16 +322,21 @@ async def send_new_tags_notification(bot, chat_id, repo_name, new_tags_details):
             parse_mode='MarkdownV2'
         )
         logger.info(f"Sent new deployable tags notification to {chat_id} for {repo_name}.")
+        return True
     except Exception as e:
         logger.error(f"Failed to send notification to {chat_id} for {repo_name}: {e}")
         # Fallback to plain text if Markdown fails
         try:
             plain_text = f"New deployable tags for {repo_name}:\n" # Not escaped, as parse_mode=None
-            for tag_detail in deployable_tags_details:
+            for tag_detail in shown_tags_details:
                 plain_text += f"- Tag: {tag_detail['name']}, Updated: {tag_detail['last_updated']}\n"
+            if hidden_count:
+                plain_text += f"... and {hidden_count} more new tags not shown.\n"
             await bot.send_message(chat_id=chat_id, text=plain_text, parse_mode=None) # Explicitly set parse_mode=None
+            return True
         except Exception as fallback_e:
             logger.error(f"Fallback plain text notification also failed for {chat_id}, {repo_name}: {fallback_e}")
+            return False
 
 
 def get_handlers():